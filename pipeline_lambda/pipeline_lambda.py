@@ -1,21 +1,26 @@
 from __future__ import print_function
 
 import json
-import traceback
 
 import boto3
 
-from utils.aws_utils import setup_s3_client, put_template_into_s3
-from utils.pipeline_utils import put_job_failure, put_job_success, continue_job_later, \
-    PipelineUserParameters, PipelineStackConfig, load_pipeline_artifacts, \
+from utils.aws_utils import setup_s3_client, put_template_into_s3, put_job_data_into_s3, get_job_data_from_s3, \
+    delete_job_data_from_s3, template_key
+from utils.pipeline_utils import put_job_failure, put_job_success, continue_job_later, get_continuation_state, \
+    pop_job_result, PipelineUserParameters, PipelineStackConfig, load_pipeline_artifacts, \
     parse_override_params, get_file_from_artifact, generate_output_artifact
 from utils.stack_utils import stack_exists, get_stack_status, \
     stack_delete, change_set_exists, execute_change_set, get_change_set_status, delete_change_set, create_change_set, \
-    update_stack, create_stack, get_stack_output
+    update_stack, create_stack, get_stack_output, get_stack_status_if_exists, change_set_name_prefix, \
+    unique_change_set_name, describe_change_set, change_set_has_no_changes, start_change_set_cleanup
 
-from utils.logging_utils import get_logger
+from utils.idempotency_utils import claim_job, complete_job
+from utils.retention_utils import record_template_reference, remove_stack_references, collect_garbage
+from utils.logging_utils import get_logger, set_log_context, log_phase
 
-logger = get_logger()
+logger = get_logger(__name__)
+FAILED_STACK_STATES = ['ROLLBACK_COMPLETE', 'ROLLBACK_FAILED', 'CREATE_FAILED', 'DELETE_FAILED',
+                       'UPDATE_FAILED', 'UPDATE_ROLLBACK_FAILED']
 
 
 def start_stack_create_or_update(cf, job_id, stack_name, template_url, config: PipelineStackConfig,
@@ -50,7 +55,7 @@ def check_stack_status(cf, job_id, stack):
     return False
 
 
-def generate_template_and_config(s3, cf, job_id, params: PipelineUserParameters, in_artifacts):
+def generate_template_and_config(s3, cf, job_id, params: PipelineUserParameters, in_artifacts, update=None):
     template = get_file_from_artifact(s3, in_artifacts.get(params.TemplateArtifact), params.TemplateFile)
     if params.ConfigFile is not None:
         config = get_file_from_artifact(s3, in_artifacts.get(params.ConfigArtifact), params.ConfigFile)
@@ -58,7 +63,9 @@ def generate_template_and_config(s3, cf, job_id, params: PipelineUserParameters,
         config = None
 
     template_url = put_template_into_s3(job_id, params.TemplateFile, json.dumps(template))
-    update = stack_exists(cf, params.StackName)
+    record_template_reference(params.StackName, template_key(job_id, params.TemplateFile))
+    if update is None:
+        update = stack_exists(cf, params.StackName)
     config = PipelineStackConfig(config, template,
                                  parse_override_params(s3, params.ParameterOverrides, in_artifacts),
                                  update,
@@ -77,14 +84,55 @@ def check_change_set_status(cf, job_id, stack, change_set):
         put_job_failure(job_id, 'Change set failed')
 
 
-def replace_stack_handler(job_id):
-    # This operation is not implemented but can be replaced with 2 other operations - delete stack + create stack
-    put_job_failure(job_id, 'not implemented')
+def create_stack_after_delete(cf, job_id, params: PipelineUserParameters, state):
+    status = get_stack_status_if_exists(cf, params.StackName)
+    if status is None:
+        config = PipelineStackConfig.from_dict(get_job_data_from_s3(state['config']))
+        create_stack(cf, params.StackName, state['template_url'], config, params.RoleArn)
+        delete_job_data_from_s3(state['config'])
+        continue_job_later(job_id, 'Stack create started')
+    elif status == 'DELETE_IN_PROGRESS':
+        continue_job_later(job_id, 'Stack delete still in progress', state)
+    else:
+        delete_job_data_from_s3(state['config'])
+        put_job_failure(job_id, 'Stack cannot be replaced, delete failed: {}'.format(status))
+
+
+def replace_stack_handler(job_id, job_data, params: PipelineUserParameters, in_artifacts):
+    s3, cf = setup_s3_client(job_data), boto3.client('cloudformation')
+
+    if 'continuationToken' in job_data:
+        state = get_continuation_state(job_data)
+        if state.get('phase') == 'delete':
+            create_stack_after_delete(cf, job_id, params, state)
+        elif check_stack_status(cf, job_id, params.StackName):
+            generate_output_artifact(s3, job_data, params, get_stack_output(cf, params.StackName))
+        return
+
+    status = get_stack_status_if_exists(cf, params.StackName)
+    if status not in FAILED_STACK_STATES:
+        template_url, config, update = generate_template_and_config(s3, cf, job_id, params, in_artifacts,
+                                                                    status is not None)
+        start_stack_create_or_update(cf, job_id, params.StackName,
+                                     template_url, config, update, params.RoleArn)
+        return
+
+    # Template upload and parameters resolution run while cfn deletes the failed stack
+    stack_delete(cf, params.StackName, params.RoleArn)
+    template_url, config, _ = generate_template_and_config(s3, cf, job_id, params, in_artifacts, False)
+    if get_stack_status_if_exists(cf, params.StackName) is None:
+        create_stack(cf, params.StackName, template_url, config, params.RoleArn)
+        continue_job_later(job_id, 'Stack create started')
+    else:
+        config_key = put_job_data_into_s3(job_id, 'stack-config', config.to_dict())
+        continue_job_later(job_id, 'Stack delete started',
+                           {'phase': 'delete', 'template_url': template_url, 'config': config_key})
 
 
 def delete_stack_handler(job_id, job_data, params: PipelineUserParameters):
     cf = boto3.client('cloudformation')
     if not stack_exists(cf, params.StackName):
+        remove_stack_references(params.StackName)
         put_job_success(job_id, "Stack do not exist")
         return
 
@@ -123,6 +171,46 @@ def execute_change_set_handler(job_id, job_data, params: PipelineUserParameters)
         continue_job_later(job_id, 'Stack create started')
 
 
+def check_and_execute_change_set(s3, cf, job_id, job_data, params: PipelineUserParameters, change_set):
+    status, reason = describe_change_set(cf, params.StackName, change_set)
+    if status in ['CREATE_PENDING', 'CREATE_IN_PROGRESS']:
+        continue_job_later(job_id, 'Change set still in progress', {'phase': 'change_set', 'change_set': change_set})
+    elif status == 'CREATE_COMPLETE':
+        execute_change_set(cf, params.StackName, change_set)
+        continue_job_later(job_id, 'Change set execution started', {'phase': 'execute', 'change_set': change_set})
+    elif change_set_has_no_changes(status, reason):
+        cleanup = start_change_set_cleanup(cf, params.StackName, change_set_name_prefix(params.ChangeSetName))
+        try:
+            generate_output_artifact(s3, job_data, params, get_stack_output(cf, params.StackName))
+            put_job_success(job_id, 'There were no stack updates')
+        finally:
+            cleanup.join()
+    else:
+        put_job_failure(job_id, 'Change set failed: {}'.format(reason))
+
+
+def create_execute_change_set_handler(job_id, job_data, params: PipelineUserParameters, in_artifacts):
+    s3, cf = setup_s3_client(job_data), boto3.client('cloudformation')
+
+    if 'continuationToken' in job_data:
+        state = get_continuation_state(job_data)
+        if state.get('phase') == 'execute':
+            if check_stack_status(cf, job_id, params.StackName):
+                generate_output_artifact(s3, job_data, params, get_stack_output(cf, params.StackName))
+        else:
+            check_and_execute_change_set(s3, cf, job_id, job_data, params, state['change_set'])
+    else:
+        change_set = unique_change_set_name(params.ChangeSetName, job_id)
+        cleanup = start_change_set_cleanup(cf, params.StackName, change_set_name_prefix(params.ChangeSetName),
+                                           keep=change_set)
+        try:
+            template_url, config, update = generate_template_and_config(s3, cf, job_id, params, in_artifacts)
+            create_change_set(cf, params.StackName, change_set, template_url, config, params.RoleArn)
+            continue_job_later(job_id, 'Change set create started', {'phase': 'change_set', 'change_set': change_set})
+        finally:
+            cleanup.join()
+
+
 def create_update_stack_handler(job_id, job_data, params: PipelineUserParameters, in_artifacts):
     s3, cf = setup_s3_client(job_data), boto3.client('cloudformation')
 
@@ -142,34 +230,63 @@ def handler(event, ctx):
     :param ctx: lambda context
     :return:
     """
-    logger.info(event)
     job_id = None
-    try:
-        job_id = event['CodePipeline.job']['id']
-        job_data = event['CodePipeline.job']['data']
-        if len(job_data.get('outputArtifacts', [])) > 1:
-            raise ValueError("Maximum number of output Artifacts is 1")
-
-        params = PipelineUserParameters(job_data, ctx)
-        in_artifacts = load_pipeline_artifacts(job_data.get('inputArtifacts', []), params.Region)
-
-        if params.ActionMode == 'CREATE_UPDATE':
-            create_update_stack_handler(job_id, job_data, params, in_artifacts)
-        elif params.ActionMode == 'DELETE_ONLY':
-            delete_stack_handler(job_id, job_data, params)
-        elif params.ActionMode == 'REPLACE_ON_FAILURE':
-            replace_stack_handler(job_id)
-        elif params.ActionMode == 'CHANGE_SET_REPLACE':
-            create_replace_change_set_handler(job_id, job_data, params, in_artifacts)
-        elif params.ActionMode == 'CHANGE_SET_EXECUTE':
-            execute_change_set_handler(job_id, job_data, params)
-        else:
-            raise ValueError("Unknown operation mode requested: {}".format(params.ActionMode))
-
-    except Exception as e:
-        logger.error('Function failed due to exception. {}'.format(e))
-        traceback.print_exc()
-        put_job_failure(job_id, 'Function exception: ' + str(e))
+    with log_phase(logger, 'invocation') as fields:
+        try:
+            job_id = event['CodePipeline.job']['id']
+            job_data = event['CodePipeline.job']['data']
+            state = get_continuation_state(job_data)
+            set_log_context(job_id, state.get('origin_job_id'))
+            logger.debug('Event %s', event)
+            fields.update(continuation='continuationToken' in job_data, state=state.get('phase'))
+            ledger_phase = state.get('phase', 'continuation') if 'continuationToken' in job_data else 'start'
+            if not claim_job(job_id, ledger_phase, ctx.get_remaining_time_in_millis() / 1000):
+                return "Complete."
+        except Exception as e:
+            logger.error('Function failed due to exception. %s', e, exc_info=True)
+            put_job_failure(job_id, 'Function exception: ' + str(e))
+            return "Complete."
+
+        try:
+            if len(job_data.get('outputArtifacts', [])) > 1:
+                raise ValueError("Maximum number of output Artifacts is 1")
+
+            params = PipelineUserParameters(job_data, ctx)
+            fields.update(action_mode=params.ActionMode, stack=params.StackName)
+            in_artifacts = load_pipeline_artifacts(job_data.get('inputArtifacts', []), params.Region)
+
+            if params.ActionMode == 'CREATE_UPDATE':
+                create_update_stack_handler(job_id, job_data, params, in_artifacts)
+            elif params.ActionMode == 'DELETE_ONLY':
+                delete_stack_handler(job_id, job_data, params)
+            elif params.ActionMode == 'REPLACE_ON_FAILURE':
+                replace_stack_handler(job_id, job_data, params, in_artifacts)
+            elif params.ActionMode == 'CHANGE_SET_REPLACE':
+                create_replace_change_set_handler(job_id, job_data, params, in_artifacts)
+            elif params.ActionMode == 'CHANGE_SET_EXECUTE':
+                execute_change_set_handler(job_id, job_data, params)
+            elif params.ActionMode == 'CHANGE_SET_REPLACE_EXECUTE':
+                create_execute_change_set_handler(job_id, job_data, params, in_artifacts)
+            else:
+                raise ValueError("Unknown operation mode requested: {}".format(params.ActionMode))
+
+        except Exception as e:
+            logger.error('Function failed due to exception. %s', e, exc_info=True)
+            put_job_failure(job_id, 'Function exception: ' + str(e))
+
+        result = pop_job_result(job_id)
+        if result is not None:
+            complete_job(job_id, ledger_phase, result)
 
-    logger.debug('Function complete.')
     return "Complete."
+
+
+def template_gc_handler(event, ctx):
+    """ The templates bucket garbage collection Lambda Function Handler
+
+    :param event: lambda event, optional MaxAgeDays overrides TEMPLATE_RETENTION_DAYS
+    :param ctx: lambda context
+    :return:
+    """
+    deleted = collect_garbage(event.get('MaxAgeDays') if isinstance(event, dict) else None)
+    return "Deleted {} objects.".format(deleted)
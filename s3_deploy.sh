@@ -2,7 +2,7 @@ BUCKET_NAME="aws-codepipeline-cfn-provider-bucket"
 BUCKET_KEY="pipeline_lambda.zip"
 
 mkdir build
-cp -r $VIRTUAL_ENV/lib/python3.6/site-packages/* build/
+cp -r $VIRTUAL_ENV/lib/python3.12/site-packages/* build/
 cp -r utils build/
 cp -r pipeline_lambda build/
 cd build
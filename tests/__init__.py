@@ -0,0 +1,4 @@
+import os
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('PIPELINE_TEMPLATES_BUCKET', 'pipeline-templates-bucket')
@@ -0,0 +1,71 @@
+import datetime
+import hashlib
+import io
+
+import botocore.session
+from botocore.exceptions import ClientError, ParamValidationError
+
+S3_MODEL = botocore.session.get_session().get_service_model('s3')
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class FakeS3:
+    def __init__(self, page_size=1000):
+        """In memory S3 client supporting the calls and conditional writes used by the lambda
+
+        Parameters are checked against the installed botocore S3 model, like the real client does.
+
+        :param page_size: number of objects returned in a listing page
+        """
+        self.objects = {}
+        self.page_size = page_size
+        self.now = datetime.datetime.now(datetime.timezone.utc)
+
+    def validate(self, operation, **kwargs):
+        members = S3_MODEL.operation_model(operation).input_shape.members
+        unknown = [name for name, value in kwargs.items() if value is not None and name not in members]
+        if unknown:
+            raise ParamValidationError(report='Unknown parameter in input: {}'.format(', '.join(unknown)))
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, IfMatch=None, **kwargs):
+        self.validate('PutObject', IfNoneMatch=IfNoneMatch, IfMatch=IfMatch, **kwargs)
+        current = self.objects.get((Bucket, Key))
+        if IfNoneMatch == '*' and current is not None:
+            raise client_error('PreconditionFailed', 'PutObject')
+        if IfMatch is not None and (current is None or current['ETag'] != IfMatch):
+            raise client_error('PreconditionFailed', 'PutObject')
+        body = Body.encode() if isinstance(Body, str) else Body
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        self.objects[(Bucket, Key)] = {'Body': body, 'ETag': etag, 'LastModified': self.now}
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('NoSuchKey', 'GetObject')
+        obj = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(obj['Body']), 'ETag': obj['ETag']}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket, obj['Key'])
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000):
+        contents = [{'Key': key, 'LastModified': obj['LastModified']}
+                    for (bucket, key), obj in sorted(self.objects.items())
+                    if bucket == Bucket and key.startswith(Prefix)][:MaxKeys]
+        return {'Contents': contents, 'KeyCount': len(contents)}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        contents = self.list_objects_v2(Bucket, Prefix, len(self.objects))['Contents']
+        for i in range(0, len(contents), self.page_size):
+            yield {'Contents': contents[i:i + self.page_size]}
@@ -0,0 +1,53 @@
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import pipeline_utils
+from utils.cache_utils import ArtifactFileCache
+
+
+class ArtifactFileCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used_by_json_size(self):
+        cache = ArtifactFileCache(max_bytes=2 * len(json.dumps({'a': 1})))
+        cache.put('a', {'a': 1})
+        cache.put('b', {'b': 2})
+        cache.get('a')
+        cache.put('c', {'c': 3})
+
+        self.assertEqual(cache.get('a'), {'a': 1})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), {'c': 3})
+
+    def test_returns_copies(self):
+        cache = ArtifactFileCache()
+        data = {'Parameters': {'a': 1}}
+        cache.put('a', data)
+        data['Parameters']['a'] = 2
+        cache.get('a')['Parameters']['a'] = 3
+
+        self.assertEqual(cache.get('a'), {'Parameters': {'a': 1}})
+
+    def test_spills_evicted_entries(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            cache = ArtifactFileCache(max_bytes=len(json.dumps({'a': 1})), spill_dir=spill_dir)
+            cache.put(('bucket', 'key', None, 'a'), {'a': 1})
+            cache.put(('bucket', 'key', None, 'b'), {'b': 2})
+
+            self.assertEqual(cache.get(('bucket', 'key', None, 'a')), {'a': 1})
+
+    def test_caches_artifacts_without_revision(self):
+        artifact = {'name': 'Build', 'revision': None,
+                    'location': {'s3Location': {'bucketName': 'bucket', 'objectKey': 'build/artifact.zip'}}}
+        first = pipeline_utils.PipelineArtifact(artifact, 'eu-central-1')
+        first.add_file('config.json', b'{"Parameters": {"a": "1"}}')
+        second = pipeline_utils.PipelineArtifact(artifact, 'eu-central-1')
+
+        s3 = mock.Mock()
+        self.assertEqual(pipeline_utils.get_file_from_artifact(s3, second, 'config.json'),
+                         {'Parameters': {'a': '1'}})
+        s3.download_file.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
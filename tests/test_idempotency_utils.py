@@ -0,0 +1,54 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ParamValidationError
+
+from tests.fake_s3 import FakeS3
+from utils import idempotency_utils
+
+BUCKET = os.environ['PIPELINE_TEMPLATES_BUCKET']
+
+
+class ClaimJobTest(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3()
+        patch = mock.patch.object(idempotency_utils.boto3, 'client', return_value=self.s3)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def entry(self):
+        response = self.s3.get_object(Bucket=BUCKET, Key=idempotency_utils.ledger_key('job-id', 'start'))
+        return json.loads(response['Body'].read())
+
+    def test_claims_new_job(self):
+        self.assertTrue(idempotency_utils.claim_job('job-id', 'start'))
+        self.assertEqual(self.entry()['status'], 'in_progress')
+
+    def test_duplicate_exits_while_claim_in_progress(self):
+        self.assertTrue(idempotency_utils.claim_job('job-id', 'start'))
+        self.assertFalse(idempotency_utils.claim_job('job-id', 'start'))
+        self.assertTrue(idempotency_utils.claim_job('job-id', 'execute'))
+
+    def test_duplicate_exits_after_completion(self):
+        self.assertTrue(idempotency_utils.claim_job('job-id', 'start'))
+        idempotency_utils.complete_job('job-id', 'start', 'success')
+
+        self.assertFalse(idempotency_utils.claim_job('job-id', 'start', lease_seconds=0))
+        self.assertEqual(self.entry(), {'status': 'completed', 'result': 'success'})
+
+    def test_takes_over_expired_claim(self):
+        self.assertTrue(idempotency_utils.claim_job('job-id', 'start', lease_seconds=-1))
+
+        self.assertTrue(idempotency_utils.claim_job('job-id', 'start'))
+        self.assertFalse(idempotency_utils.claim_job('job-id', 'start'))
+
+    def test_fails_open_without_conditional_writes_support(self):
+        with mock.patch.object(self.s3, 'put_object', side_effect=ParamValidationError(report='IfNoneMatch')):
+            self.assertTrue(idempotency_utils.claim_job('job-id', 'start'))
+            idempotency_utils.complete_job('job-id', 'start', 'success')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import io
+import json
+import logging
+import os
+import unittest
+from unittest import mock
+
+from pipeline_lambda import pipeline_lambda
+from utils import logging_utils, pipeline_utils
+
+
+class DebugSamplingTest(unittest.TestCase):
+    def test_continuation_token_carries_origin_job_id(self):
+        with mock.patch.object(pipeline_utils, 'code_pipeline') as code_pipeline:
+            logging_utils.set_log_context('job-1')
+            pipeline_utils.continue_job_later('job-1', 'started')
+            token = json.loads(code_pipeline.put_job_success_result.call_args[1]['continuationToken'])
+            self.assertEqual(token['origin_job_id'], 'job-1')
+
+            logging_utils.set_log_context('job-2', token['origin_job_id'])
+            pipeline_utils.continue_job_later('job-2', 'in progress')
+            token = json.loads(code_pipeline.put_job_success_result.call_args[1]['continuationToken'])
+            self.assertEqual(token['origin_job_id'], 'job-1')
+
+    def test_sampling_uses_origin_job_id(self):
+        with mock.patch.dict(os.environ, {'LOG_DEBUG_SAMPLE_RATE': '0.5'}):
+            origin = next(job for job in ('job-{}'.format(i) for i in range(100)) if logging_utils.debug_sampled(job))
+            for job_id in ['job-a', 'job-b', 'job-c']:
+                logging_utils.set_log_context(job_id, origin)
+                self.assertTrue(logging_utils.get_logger().isEnabledFor(logging.DEBUG))
+        logging_utils.set_log_context(None)
+
+    def test_sampling_keeps_aws_libraries_at_warning(self):
+        with mock.patch.dict(os.environ, {'LOG_DEBUG_SAMPLE_RATE': '1'}):
+            logging_utils.set_log_context('job-id')
+            self.assertTrue(logging_utils.get_logger(__name__).isEnabledFor(logging.DEBUG))
+            for name in ['botocore', 'boto3', 'urllib3', 's3transfer']:
+                self.assertFalse(logging.getLogger(name).isEnabledFor(logging.DEBUG))
+        logging_utils.set_log_context(None)
+
+
+class RedactionTest(unittest.TestCase):
+    credentials = {'accessKeyId': 'AKIAEXAMPLEKEYID', 'secretAccessKey': 'example-secret-access-key',
+                   'sessionToken': 'example-session-token'}
+
+    def event(self):
+        artifacts = [{'name': 'Artifact{}'.format(i), 'revision': None, 'location': {'type': 'S3', 's3Location': {
+            'bucketName': 'codepipeline-artifacts-bucket', 'objectKey': 'pipeline/Artifact{}/abcdefg'.format(i)}}}
+            for i in range(4)]
+        return {'CodePipeline.job': {'id': 'job-id', 'accountId': '123456789012', 'data': {
+            'actionConfiguration': {'configuration': {
+                'FunctionName': 'pipeline-lambda', 'UserParameters': '{"ActionMode": "UNKNOWN", "StackName": "s"}'}},
+            'inputArtifacts': artifacts,
+            'outputArtifacts': artifacts[:1],
+            'artifactCredentials': self.credentials,
+            'continuationToken': json.dumps({'previous_job_id': 'previous-job-id', 'origin_job_id': 'origin'})}}}
+
+    def test_sampled_handler_logs_never_contain_credentials(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging_utils.JsonFormatter())
+        logging.getLogger().addHandler(handler)
+        self.addCleanup(logging.getLogger().removeHandler, handler)
+        self.addCleanup(logging_utils.set_log_context, None)
+        ctx = mock.Mock(invoked_function_arn='arn:aws:lambda:eu-central-1:123456789012:function:test')
+        ctx.get_remaining_time_in_millis.return_value = 60000
+
+        with mock.patch.dict(os.environ, {'LOG_DEBUG_SAMPLE_RATE': '1'}), \
+                mock.patch.object(pipeline_lambda, 'claim_job', return_value=True), \
+                mock.patch.object(pipeline_lambda, 'complete_job'), \
+                mock.patch.object(pipeline_utils, 'code_pipeline'):
+            pipeline_lambda.handler(self.event(), ctx)
+
+        output = stream.getvalue()
+        event_record = json.loads(output.splitlines()[0])
+        self.assertEqual(event_record['level'], 'DEBUG')
+        self.assertIn('outputArtifacts', event_record['message'])
+        self.assertIn('continuationToken', event_record['message'])
+        for value in self.credentials.values():
+            self.assertNotIn(value, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import unittest
+from unittest import mock
+
+from pipeline_lambda import pipeline_lambda
+
+STATE = {'phase': 'delete', 'template_url': 'https://s3.eu-central-1.amazonaws.com/bucket/job/template.json',
+         'config': 'job/stack-config.json'}
+CONFIG = {'Parameters': [], 'Tags': [], 'StackPolicy': None, 'Capabilities': None, 'Update': False}
+
+
+class CreateStackAfterDeleteTest(unittest.TestCase):
+    def setUp(self):
+        self.params = mock.Mock(StackName='test-stack', RoleArn='role-arn')
+        patches = {name: mock.patch.object(pipeline_lambda, name) for name in [
+            'get_stack_status_if_exists', 'get_job_data_from_s3', 'delete_job_data_from_s3', 'create_stack',
+            'continue_job_later', 'put_job_failure']}
+        self.mocks = {name: patch.start() for name, patch in patches.items()}
+        self.addCleanup(mock.patch.stopall)
+        self.mocks['get_job_data_from_s3'].return_value = CONFIG
+
+    def test_creates_stack_when_deleted(self):
+        self.mocks['get_stack_status_if_exists'].return_value = None
+
+        pipeline_lambda.create_stack_after_delete('cf', 'job-id', self.params, STATE)
+
+        args = self.mocks['create_stack'].call_args[0]
+        self.assertEqual(args[:3], ('cf', 'test-stack', STATE['template_url']))
+        self.assertEqual(args[3].Update, False)
+        self.mocks['delete_job_data_from_s3'].assert_called_once_with(STATE['config'])
+        self.mocks['continue_job_later'].assert_called_once_with('job-id', 'Stack create started')
+        self.mocks['put_job_failure'].assert_not_called()
+
+    def test_waits_while_delete_in_progress(self):
+        self.mocks['get_stack_status_if_exists'].return_value = 'DELETE_IN_PROGRESS'
+
+        pipeline_lambda.create_stack_after_delete('cf', 'job-id', self.params, STATE)
+
+        self.mocks['create_stack'].assert_not_called()
+        self.mocks['delete_job_data_from_s3'].assert_not_called()
+        self.mocks['continue_job_later'].assert_called_once_with('job-id', mock.ANY, STATE)
+
+    def test_fails_when_delete_failed(self):
+        self.mocks['get_stack_status_if_exists'].return_value = 'DELETE_FAILED'
+
+        pipeline_lambda.create_stack_after_delete('cf', 'job-id', self.params, STATE)
+
+        self.mocks['create_stack'].assert_not_called()
+        self.mocks['delete_job_data_from_s3'].assert_called_once_with(STATE['config'])
+        self.mocks['continue_job_later'].assert_not_called()
+        self.mocks['put_job_failure'].assert_called_once_with('job-id', mock.ANY)
+
+
+class ReplaceStackHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.params = mock.Mock(StackName='test-stack', RoleArn='role-arn')
+        self.config = mock.Mock()
+        self.config.to_dict.return_value = CONFIG
+        self.calls = mock.Mock()
+        for name in ['setup_s3_client', 'boto3', 'get_stack_status_if_exists', 'stack_delete',
+                     'generate_template_and_config', 'create_stack', 'put_job_data_into_s3',
+                     'continue_job_later', 'start_stack_create_or_update']:
+            self.calls.attach_mock(mock.patch.object(pipeline_lambda, name).start(), name)
+        self.addCleanup(mock.patch.stopall)
+        self.calls.setup_s3_client.return_value = 's3'
+        self.calls.boto3.client.return_value = 'cf'
+        self.calls.generate_template_and_config.return_value = (STATE['template_url'], self.config, False)
+        self.calls.put_job_data_into_s3.return_value = STATE['config']
+
+    def replace(self, *statuses):
+        self.calls.get_stack_status_if_exists.side_effect = list(statuses)
+        pipeline_lambda.replace_stack_handler('job-id', {}, self.params, 'artifacts')
+
+    def test_creates_stack_right_away_when_failed_stack_is_deleted(self):
+        self.replace('ROLLBACK_COMPLETE', None)
+
+        self.assertEqual([c[0] for c in self.calls.mock_calls if not c[0].startswith('boto3')], [
+            'setup_s3_client', 'get_stack_status_if_exists', 'stack_delete', 'generate_template_and_config',
+            'get_stack_status_if_exists', 'create_stack', 'continue_job_later'])
+        self.calls.generate_template_and_config.assert_called_once_with(
+            's3', 'cf', 'job-id', self.params, 'artifacts', False)
+        self.calls.create_stack.assert_called_once_with(
+            'cf', 'test-stack', STATE['template_url'], self.config, 'role-arn')
+        self.calls.continue_job_later.assert_called_once_with('job-id', 'Stack create started')
+
+    def test_stores_config_while_failed_stack_is_deleted(self):
+        self.replace('UPDATE_ROLLBACK_FAILED', 'DELETE_IN_PROGRESS')
+
+        self.assertEqual([c[0] for c in self.calls.mock_calls if not c[0].startswith('boto3')], [
+            'setup_s3_client', 'get_stack_status_if_exists', 'stack_delete', 'generate_template_and_config',
+            'get_stack_status_if_exists', 'put_job_data_into_s3', 'continue_job_later'])
+        self.calls.put_job_data_into_s3.assert_called_once_with('job-id', 'stack-config', CONFIG)
+        self.calls.continue_job_later.assert_called_once_with('job-id', mock.ANY, STATE)
+        self.calls.create_stack.assert_not_called()
+
+    def test_updates_stack_which_is_not_failed(self):
+        self.calls.generate_template_and_config.return_value = (STATE['template_url'], self.config, True)
+
+        self.replace('UPDATE_COMPLETE')
+
+        self.calls.stack_delete.assert_not_called()
+        self.calls.generate_template_and_config.assert_called_once_with(
+            's3', 'cf', 'job-id', self.params, 'artifacts', True)
+        self.calls.start_stack_create_or_update.assert_called_once_with(
+            'cf', 'job-id', 'test-stack', STATE['template_url'], self.config, True, 'role-arn')
+
+    def test_creates_missing_stack(self):
+        self.replace(None)
+
+        self.calls.stack_delete.assert_not_called()
+        self.calls.generate_template_and_config.assert_called_once_with(
+            's3', 'cf', 'job-id', self.params, 'artifacts', False)
+        self.calls.start_stack_create_or_update.assert_called_once_with(
+            'cf', 'job-id', 'test-stack', STATE['template_url'], self.config, False, 'role-arn')
+
+
+class CreateExecuteChangeSetTest(unittest.TestCase):
+    change_set = 'app-0b1c2d3e-1234-4abc-8def-0123456789ab'
+
+    def setUp(self):
+        self.params = mock.Mock(StackName='test-stack', ChangeSetName='app', RoleArn='role-arn')
+        patches = {name: mock.patch.object(pipeline_lambda, name) for name in [
+            'describe_change_set', 'execute_change_set', 'start_change_set_cleanup', 'generate_output_artifact',
+            'get_stack_output', 'continue_job_later', 'put_job_success', 'put_job_failure']}
+        self.mocks = {name: patch.start() for name, patch in patches.items()}
+        self.addCleanup(mock.patch.stopall)
+
+    def check(self, status, reason=''):
+        self.mocks['describe_change_set'].return_value = (status, reason)
+        pipeline_lambda.check_and_execute_change_set('s3', 'cf', 'job-id', {}, self.params, self.change_set)
+
+    def test_waits_for_pending_change_set(self):
+        self.check('CREATE_PENDING')
+
+        self.mocks['execute_change_set'].assert_not_called()
+        self.mocks['continue_job_later'].assert_called_once_with(
+            'job-id', mock.ANY, {'phase': 'change_set', 'change_set': self.change_set})
+
+    def test_executes_created_change_set(self):
+        self.check('CREATE_COMPLETE')
+
+        self.mocks['execute_change_set'].assert_called_once_with('cf', 'test-stack', self.change_set)
+        self.mocks['continue_job_later'].assert_called_once_with(
+            'job-id', mock.ANY, {'phase': 'execute', 'change_set': self.change_set})
+
+    def test_succeeds_without_changes(self):
+        self.mocks['get_stack_output'].return_value = {'Output': 'value'}
+
+        self.check('FAILED', "The submitted information didn't contain changes. Submit different information.")
+
+        self.mocks['execute_change_set'].assert_not_called()
+        self.mocks['start_change_set_cleanup'].assert_called_once_with('cf', 'test-stack', 'app-')
+        self.mocks['start_change_set_cleanup'].return_value.join.assert_called_once_with()
+        self.mocks['generate_output_artifact'].assert_called_once_with('s3', {}, self.params, {'Output': 'value'})
+        self.mocks['put_job_success'].assert_called_once_with('job-id', mock.ANY)
+        self.mocks['put_job_failure'].assert_not_called()
+
+    def test_fails_on_failed_change_set(self):
+        self.check('FAILED', 'Template format error')
+
+        self.mocks['execute_change_set'].assert_not_called()
+        self.mocks['put_job_success'].assert_not_called()
+        self.mocks['put_job_failure'].assert_called_once_with('job-id', 'Change set failed: Template format error')
+
+
+class HandlerLedgerTest(unittest.TestCase):
+    event = {'CodePipeline.job': {'id': 'job-id', 'data': {
+        'actionConfiguration': {'configuration': {'UserParameters': '{"ActionMode": "UNKNOWN"}'}}}}}
+
+    def setUp(self):
+        self.ctx = mock.Mock(invoked_function_arn='arn:aws:lambda:eu-central-1:123456789012:function:test')
+        self.ctx.get_remaining_time_in_millis.return_value = 60000
+        for name in ['claim_job', 'complete_job']:
+            patch = mock.patch.object(pipeline_lambda, name)
+            setattr(self, name, patch.start())
+            self.addCleanup(patch.stop)
+        self.claim_job.return_value = True
+
+    def test_completes_claim_with_reported_result(self):
+        with mock.patch('utils.pipeline_utils.code_pipeline'):
+            pipeline_lambda.handler(self.event, self.ctx)
+
+        self.complete_job.assert_called_once_with('job-id', 'start', 'failure')
+
+    def test_keeps_claim_when_result_was_not_reported(self):
+        with mock.patch('utils.pipeline_utils.code_pipeline') as code_pipeline:
+            code_pipeline.put_job_failure_result.side_effect = Exception('throttled')
+            with self.assertRaises(Exception):
+                pipeline_lambda.handler(self.event, self.ctx)
+
+        self.complete_job.assert_not_called()
+
+    def test_duplicate_exits_without_reporting(self):
+        self.claim_job.return_value = False
+        with mock.patch('utils.pipeline_utils.code_pipeline') as code_pipeline:
+            pipeline_lambda.handler(self.event, self.ctx)
+
+        self.assertEqual(code_pipeline.mock_calls, [])
+        self.complete_job.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import datetime
+import os
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ParamValidationError
+
+from tests.fake_s3 import FakeS3
+from utils import retention_utils
+
+BUCKET = os.environ['PIPELINE_TEMPLATES_BUCKET']
+
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3(page_size=2)
+        patch = mock.patch.object(retention_utils.boto3, 'client', return_value=self.s3)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def put(self, key, age_days, body='{}'):
+        self.s3.now = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=age_days)
+        self.s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        self.s3.now = datetime.datetime.now(datetime.timezone.utc)
+
+    def keys(self):
+        return sorted(key for _, key in self.s3.objects)
+
+    def test_manifests_are_sharded_per_stack(self):
+        retention_utils.record_template_reference('stack-a', 'job1/template.json')
+        retention_utils.record_template_reference('stack-b', 'job2/template.json')
+        retention_utils.record_template_reference('stack-a', 'job3/template.json')
+        retention_utils.remove_stack_references('stack-b')
+
+        manifest_a, _ = retention_utils.load_manifest(self.s3, BUCKET, '_retention/stack-a.json')
+        manifest_b, _ = retention_utils.load_manifest(self.s3, BUCKET, '_retention/stack-b.json')
+        self.assertEqual(manifest_a['keys'], ['job3/template.json', 'job1/template.json'])
+        self.assertEqual(manifest_b['keys'], [])
+
+    def test_record_template_reference_never_fails_the_job(self):
+        retention_utils.record_template_reference('stack', 'job1/template.json')
+        with mock.patch.object(self.s3, 'put_object', side_effect=ParamValidationError(report='IfMatch')):
+            retention_utils.record_template_reference('stack', 'job2/template.json')
+
+        manifest, _ = retention_utils.load_manifest(self.s3, BUCKET, '_retention/stack.json')
+        self.assertEqual(manifest['keys'], ['job1/template.json'])
+
+    def test_collect_garbage_deletes_only_expired_unreferenced_objects(self):
+        self.put('old/referenced.json', 40)
+        self.put('old/unreferenced.json', 40)
+        self.put('old/unreferenced-2.json', 40)
+        self.put('new/unreferenced.json', 1)
+        retention_utils.record_template_reference('stack', 'old/referenced.json')
+        self.put('_retention/deleted-stack.json', 40, '{"version": 1, "keys": []}')
+
+        self.assertEqual(retention_utils.collect_garbage(30), 2)
+        self.assertEqual(self.keys(), ['_retention/deleted-stack.json', '_retention/stack.json',
+                                       'new/unreferenced.json', 'old/referenced.json'])
+
+    def test_collect_garbage_refuses_to_run_without_manifests(self):
+        self.put('old/template.json', 40)
+
+        with self.assertRaises(Exception):
+            retention_utils.collect_garbage(30)
+        self.assertEqual(self.keys(), ['old/template.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+from utils import stack_utils
+
+JOB_IDS = ['0b1c2d3e-1234-4abc-8def-0123456789a{}'.format(i) for i in range(5)]
+
+
+class FakeCloudFormation:
+    def __init__(self, pages):
+        self.pages = pages
+        self.deleted = []
+
+    def list_change_sets(self, StackName, NextToken=None):
+        index = int(NextToken or 0)
+        response = {'Summaries': self.pages[index]}
+        if index + 1 < len(self.pages):
+            response['NextToken'] = str(index + 1)
+        return response
+
+    def delete_change_set(self, ChangeSetName, StackName):
+        self.deleted.append(ChangeSetName)
+
+
+def summary(name, status='CREATE_COMPLETE', execution_status='AVAILABLE'):
+    return {'ChangeSetName': name, 'Status': status, 'ExecutionStatus': execution_status}
+
+
+class ChangeSetNameTest(unittest.TestCase):
+    def test_unique_name_is_truncated_to_128_characters(self):
+        name = stack_utils.unique_change_set_name('a' * 200, JOB_IDS[0])
+
+        self.assertEqual(len(name), 128)
+        self.assertTrue(name.endswith('-' + JOB_IDS[0]))
+        self.assertTrue(name.startswith(stack_utils.change_set_name_prefix('a' * 200)))
+
+    def test_short_name_is_kept(self):
+        self.assertEqual(stack_utils.unique_change_set_name('app', JOB_IDS[0]), 'app-' + JOB_IDS[0])
+
+
+class DeleteStaleChangeSetsTest(unittest.TestCase):
+    def test_deletes_only_prefix_and_job_id_names(self):
+        cf = FakeCloudFormation([[
+            summary('app-' + JOB_IDS[0]),
+            summary('app-db-' + JOB_IDS[1]),
+            summary('app-manual'),
+            summary('other-' + JOB_IDS[2]),
+        ]])
+
+        stack_utils.delete_stale_change_sets(cf, 'stack', 'app-')
+
+        self.assertEqual(cf.deleted, ['app-' + JOB_IDS[0]])
+
+    def test_skips_kept_and_in_progress_change_sets(self):
+        cf = FakeCloudFormation([[
+            summary('app-' + JOB_IDS[0]),
+            summary('app-' + JOB_IDS[1], status='CREATE_IN_PROGRESS'),
+            summary('app-' + JOB_IDS[2], status='CREATE_PENDING'),
+            summary('app-' + JOB_IDS[3], execution_status='EXECUTE_IN_PROGRESS'),
+            summary('app-' + JOB_IDS[4], status='FAILED', execution_status='UNAVAILABLE'),
+        ]])
+
+        stack_utils.delete_stale_change_sets(cf, 'stack', 'app-', keep='app-' + JOB_IDS[0])
+
+        self.assertEqual(cf.deleted, ['app-' + JOB_IDS[4]])
+
+    def test_follows_pagination(self):
+        cf = FakeCloudFormation([[summary('app-' + JOB_IDS[0])], [], [summary('app-' + JOB_IDS[1])]])
+
+        stack_utils.delete_stale_change_sets(cf, 'stack', 'app-')
+
+        self.assertEqual(cf.deleted, ['app-' + JOB_IDS[0], 'app-' + JOB_IDS[1]])
+
+    def test_cleanup_errors_are_only_logged(self):
+        cf = mock.Mock()
+        cf.list_change_sets.side_effect = Exception('throttled')
+
+        stack_utils.start_change_set_cleanup(cf, 'stack', 'app-').join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,11 +5,12 @@ import os
 
 from boto3.session import Session
 import botocore
+from botocore.exceptions import ClientError
 from cfn_flip import to_json
 
 from utils.logging_utils import get_logger
 
-logger = get_logger()
+logger = get_logger(__name__)
 ROLE_SESSION_PREFIX = 'infra-pipeline'
 
 
@@ -31,7 +32,7 @@ def setup_s3_client(job_data):
                           aws_secret_access_key=key_secret,
                           aws_session_token=session_token)
     except Exception as e:
-        logger.warn('No credentials in artifact - using default role access: {}'.format(e))
+        logger.warning('No credentials in artifact - using default role access: %s', e)
         session = Session()
 
     return session.client('s3', config=botocore.client.Config(signature_version='s3v4'))
@@ -51,10 +52,20 @@ def file_to_dict(filename, data):
         except Exception as _:
             return json.loads(data)
     except Exception as error:
-        logger.error("Failed to parse s3 file {}, error: {}".format(filename, str(error)))
+        logger.error("Failed to parse s3 file %s, error: %s", filename, error)
         raise ValueError("Unable to load JSON file {} error: {}".format(filename, str(error)))
 
 
+def template_key(job_id, file_name):
+    """Returns key of the template uploaded by put_template_into_s3
+
+    :param job_id: pipeline job id
+    :param file_name: template file name
+    :return: key in templates bucket
+    """
+    return "{}/{}.json".format(job_id, file_name)
+
+
 def put_template_into_s3(job_id, file_name, template):
     """Uploads cfn template to s3 bucket
 
@@ -65,12 +76,51 @@ def put_template_into_s3(job_id, file_name, template):
     """
     client = boto3.client('s3')
     bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
-    key = "{}/{}.json".format(job_id, file_name)
+    key = template_key(job_id, file_name)
     client.put_object(Bucket=bucket, Key=key, Body=template)
     region = client.get_bucket_location(Bucket=bucket)['LocationConstraint']
     return "https://s3.{}.amazonaws.com/{}/{}".format(region, bucket, key)
 
 
+def put_job_data_into_s3(job_id, file_name, data):
+    """Stores job data which has to survive between job invocations in templates bucket
+
+    :param job_id: pipeline job id
+    :param file_name: data file name
+    :param data: dict
+    :return: key of inserted file
+    """
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    key = "{}/{}.json".format(job_id, file_name)
+    client.put_object(Bucket=bucket, Key=key, Body=json.dumps(data), ServerSideEncryption='aws:kms')
+    return key
+
+
+def get_job_data_from_s3(key):
+    """Loads job data stored by put_job_data_into_s3
+
+    :param key: key of the file
+    :return: dict
+    """
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    return json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def delete_job_data_from_s3(key):
+    """Deletes job data stored by put_job_data_into_s3, failures are only logged
+
+    :param key: key of the file
+    """
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    try:
+        client.delete_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        logger.warning('Failed to delete job data %s: %s', key, e)
+
+
 def build_role_arn(account, role_name):
     """Build role arn
 
@@ -0,0 +1,102 @@
+import collections
+import copy
+import hashlib
+import json
+import os
+
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+# Parsed files take several times their JSON size in memory, the default fits 128MB Lambda
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+
+
+class ArtifactFileCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_dir=None):
+        """LRU cache of parsed artifact files which lives as long as the Lambda container
+
+        Entries evicted from memory are written to spill_dir if it's set, spilled files are limited by max_bytes too.
+
+        :param max_bytes: maximum size of cached files, measured as size of parsed files serialized to JSON
+        :param spill_dir: directory for evicted entries, e.g. /tmp/artifact-cache
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.spilled = collections.OrderedDict()
+        self.spilled_size = 0
+
+    def get(self, key):
+        """Returns copy of cached file so callers can modify it
+
+        :param key: tuple bucket, object key, revision, file name
+        :return: parsed file or None if not cached
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return copy.deepcopy(self.entries[key][0])
+        if key in self.spilled:
+            data = self.load_spilled(key)
+            if data is not None:
+                self.put(key, data)
+                return data
+        return None
+
+    def put(self, key, data):
+        """Stores copy of parsed file, least recently used entries are evicted when cache is full
+
+        :param key: tuple bucket, object key, revision, file name
+        :param data: parsed file
+        """
+        encoded = json.dumps(data, separators=(',', ':'))
+        size = len(encoded)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (json.loads(encoded), size)
+        self.size += size
+        while self.size > self.max_bytes:
+            evicted_key, (evicted, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.spill(evicted_key, evicted, evicted_size)
+
+    def spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(json.dumps(key).encode()).hexdigest() + '.json')
+
+    def spill(self, key, data, size):
+        if self.spill_dir is None or key in self.spilled:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self.spill_path(key), 'w') as f:
+                json.dump(data, f)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning('Failed to spill artifact file to %s: %s', self.spill_dir, e)
+            return
+        self.spilled[key] = size
+        self.spilled_size += size
+        while self.spilled_size > self.max_bytes:
+            self.remove_spilled(next(iter(self.spilled)))
+
+    def load_spilled(self, key):
+        try:
+            with open(self.spill_path(key)) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Failed to load spilled artifact file: %s', e)
+            data = None
+        self.remove_spilled(key)
+        return data
+
+    def remove_spilled(self, key):
+        self.spilled_size -= self.spilled.pop(key)
+        try:
+            os.remove(self.spill_path(key))
+        except OSError:
+            pass
+
+
+artifact_file_cache = ArtifactFileCache(int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                                        os.environ.get('ARTIFACT_CACHE_SPILL_DIR'))
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from utils.logging_utils import get_logger, add_log_fields
+
+logger = get_logger(__name__)
+LEDGER_PREFIX = '_idempotency'
+DEFAULT_LEASE_SECONDS = 300
+
+
+def ledger_key(job_id, phase):
+    """Returns key of the ledger entry in templates bucket
+
+    :param job_id: pipeline job id
+    :param phase: job phase
+    :return: key
+    """
+    return "{}/{}/{}.json".format(LEDGER_PREFIX, job_id, phase)
+
+
+def is_precondition_failure(error: ClientError):
+    return error.response['Error']['Code'] in ['PreconditionFailed', 'ConditionalRequestConflict', '412']
+
+
+def claim_job(job_id, phase, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Claims job phase using S3 conditional write so duplicate invocations can exit early
+
+    Claim of an invocation which didn't complete before lease expiration can be taken over.
+    Ledger errors other than a lost claim, including botocore without conditional writes support,
+    are logged and the job is processed anyway.
+
+    :param job_id: pipeline job id
+    :param phase: job phase
+    :param lease_seconds: time after which not completed claim can be taken over
+    :return: True if claimed, False if the phase is handled by another invocation
+    """
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    key = ledger_key(job_id, phase)
+    body = json.dumps({'status': 'in_progress', 'expires': time.time() + lease_seconds})
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch='*')
+        return True
+    except ClientError as e:
+        if not is_precondition_failure(e):
+            logger.warning('Failed to claim job %s phase %s: %s', job_id, phase, e)
+            return True
+    except BotoCoreError as e:
+        logger.warning('Failed to claim job %s phase %s: %s', job_id, phase, e)
+        return True
+
+    try:
+        response = client.get_object(Bucket=bucket, Key=key)
+        entry = json.loads(response['Body'].read())
+        if entry['status'] != 'in_progress' or entry['expires'] > time.time():
+            add_log_fields(duplicate=True, ledger_status=entry['status'], ledger_result=entry.get('result'))
+            return False
+        client.put_object(Bucket=bucket, Key=key, Body=body, IfMatch=response['ETag'])
+        add_log_fields(ledger_takeover=True)
+        return True
+    except ClientError as e:
+        if is_precondition_failure(e):
+            add_log_fields(duplicate=True)
+            return False
+        logger.warning('Failed to check claim of job %s phase %s: %s', job_id, phase, e)
+        return True
+    except BotoCoreError as e:
+        logger.warning('Failed to check claim of job %s phase %s: %s', job_id, phase, e)
+        return True
+
+
+def complete_job(job_id, phase, result):
+    """Marks claimed job phase as completed, duplicates arriving later only report the result
+
+    :param job_id: pipeline job id
+    :param phase: job phase
+    :param result: job result reported to CodePipeline
+    """
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    try:
+        client.put_object(Bucket=bucket, Key=ledger_key(job_id, phase),
+                          Body=json.dumps({'status': 'completed', 'result': result}))
+    except (BotoCoreError, ClientError) as e:
+        logger.warning('Failed to complete job %s phase %s: %s', job_id, phase, e)
@@ -1,17 +1,170 @@
+import contextlib
+import json
 import logging
+import time
+import zlib
 
 import os
 
+REDACTED = '***'
+REDACTED_KEYS = ['artifactCredentials', 'accessKeyId', 'secretAccessKey', 'sessionToken',
+                 'AccessKeyId', 'SecretAccessKey', 'SessionToken', 'Credentials']
+TEMPLATE_KEYS = ['TemplateBody', 'template', 'Template']
+DEFAULT_MAX_FIELD_LENGTH = 1024
+PROJECT_LOGGER = 'cfn_provider'
+LIBRARY_LOGGERS = ['boto3', 'botocore', 'urllib3', 's3transfer']
+
+log_context = {'job_id': None, 'origin_job_id': None, 'fields': None}
+
+
+def redact(value, max_length=DEFAULT_MAX_FIELD_LENGTH):
+    """Returns copy of value with credentials removed and long strings truncated
+
+    :param value: value to redact - dict, list or scalar
+    :param max_length: maximum length of a string
+    :return: redacted value
+    """
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in REDACTED_KEYS:
+                result[key] = REDACTED
+            elif key in TEMPLATE_KEYS and item is not None:
+                result[key] = '<{} bytes>'.format(len(item if isinstance(item, str) else json.dumps(item)))
+            else:
+                result[key] = redact(item, max_length)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [redact(item, max_length) for item in value]
+    if isinstance(value, str) and len(value) > max_length:
+        return '{}...<{} bytes>'.format(value[:max_length], len(value))
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_length=DEFAULT_MAX_FIELD_LENGTH):
+        """Formats log records as single line JSON documents
+
+        Message arguments are redacted and interpolated only when the record is emitted,
+        long arguments are truncated but the message itself isn't.
+
+        :param max_length: maximum length of a logged string
+        """
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record):
+        if isinstance(record.args, dict):
+            record.args = redact(record.args, self.max_length)
+        elif record.args:
+            record.args = tuple(redact(arg, self.max_length) if isinstance(arg, (dict, list, str)) else arg
+                                for arg in record.args)
+        document = {
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'job_id': log_context['job_id'],
+            'origin_job_id': log_context['origin_job_id'],
+        }
+        if getattr(record, 'fields', None):
+            document.update(redact(record.fields, self.max_length))
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+def configured_log_level():
+    return os.environ.get("LOG_LEVEL", "INFO").upper()
+
+
+def configure_logging():
+    """Configures root logger handlers with JsonFormatter, project logger with LOG_LEVEL level
+
+    Lambda runtime installs its own root handler, it's reused to avoid duplicated records.
+    AWS libraries log request details including credentials at DEBUG level, they're kept at WARNING.
+    """
+    root = logging.getLogger()
+    if getattr(root, 'json_configured', False):
+        return
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    max_length = int(os.environ.get('LOG_MAX_FIELD_LENGTH', DEFAULT_MAX_FIELD_LENGTH))
+    for handler in root.handlers:
+        handler.setFormatter(JsonFormatter(max_length))
+    root.setLevel(logging.WARNING)
+    for name in LIBRARY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    logging.getLogger(PROJECT_LOGGER).setLevel(configured_log_level())
+    root.json_configured = True
+
 
 def get_logger(lambda_function_name=None):
     """
-    Return logger with formatter
+    Return project logger with formatter
 
-    :param lambda_function_name:
+    :param lambda_function_name: logger name, e.g. module __name__
     :return: object - logger
     """
-    logging.basicConfig(level=logging.DEBUG)
-    logger = logging.getLogger(lambda_function_name)
-    logger.setLevel(os.environ.get("LOG_LEVEL", logging.DEBUG))
-    logger.addFilter(logging.StreamHandler())
-    return logger
+    configure_logging()
+    if lambda_function_name is None:
+        return logging.getLogger(PROJECT_LOGGER)
+    return logging.getLogger('{}.{}'.format(PROJECT_LOGGER, lambda_function_name))
+
+
+def debug_sampled(job_id):
+    """Check if DEBUG logs should be written for the job
+
+    LOG_DEBUG_SAMPLE_RATE is a fraction of jobs (0.0 - 1.0) logged with DEBUG level.
+
+    :param job_id: id of the first job of the action, continuations get new job ids
+    :return: True or False
+    """
+    rate = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0))
+    if job_id is None or rate <= 0:
+        return False
+    return zlib.crc32(job_id.encode()) % 10000 < rate * 10000
+
+
+def set_log_context(job_id, origin_job_id=None):
+    """Sets job ids added to every record and enables DEBUG level of project loggers for sampled jobs
+
+    Sampling uses the origin job id so all invocations of a sampled action are logged with DEBUG level.
+
+    :param job_id: pipeline job id
+    :param origin_job_id: id of the first job of the action, job_id is used if None
+    """
+    log_context['job_id'] = job_id
+    log_context['origin_job_id'] = origin_job_id or job_id
+    level = 'DEBUG' if debug_sampled(log_context['origin_job_id']) else configured_log_level()
+    logging.getLogger(PROJECT_LOGGER).setLevel(level)
+
+
+def add_log_fields(**fields):
+    """Adds fields to the record of the current phase, no-op outside of log_phase
+
+    :param fields: fields to add
+    """
+    if log_context['fields'] is not None:
+        log_context['fields'].update(fields)
+
+
+@contextlib.contextmanager
+def log_phase(logger, phase, **fields):
+    """Writes one INFO record with phase duration and fields collected by add_log_fields
+
+    :param logger: logger
+    :param phase: phase name
+    :param fields: initial record fields
+    :return: dict with record fields
+    """
+    previous = log_context['fields']
+    log_context['fields'] = dict(fields, phase=phase)
+    start = time.time()
+    try:
+        yield log_context['fields']
+    except Exception as e:
+        log_context['fields']['error'] = str(e)
+        raise
+    finally:
+        record_fields, log_context['fields'] = log_context['fields'], previous
+        record_fields['duration_ms'] = int((time.time() - start) * 1000)
+        logger.info(phase, extra={'fields': record_fields})
@@ -5,10 +5,12 @@ import zipfile
 import boto3
 
 from utils.aws_utils import file_to_dict
-from utils.logging_utils import get_logger
+from utils.cache_utils import artifact_file_cache
+from utils.logging_utils import get_logger, add_log_fields, log_context
 
 code_pipeline = boto3.client('codepipeline')
-logger = get_logger()
+logger = get_logger(__name__)
+reported_job_results = {}
 
 
 class PipelineUserParameters:
@@ -24,6 +26,7 @@ class PipelineUserParameters:
             - REPLACE_ON_FAILURE
             - CHANGE_SET_REPLACE
             - CHANGE_SET_EXECUTE
+            - CHANGE_SET_REPLACE_EXECUTE
         """
         logger.debug("getting user parameters")
         user_parameters = None
@@ -43,18 +46,19 @@ class PipelineUserParameters:
             raise Exception('Your UserParameters JSON must include the ActionMode')
 
         if decoded_parameters['ActionMode'] not in ['CREATE_UPDATE', 'DELETE_ONLY', 'REPLACE_ON_FAILURE',
-                                                    'CHANGE_SET_REPLACE', 'CHANGE_SET_EXECUTE']:
+                                                    'CHANGE_SET_REPLACE', 'CHANGE_SET_EXECUTE',
+                                                    'CHANGE_SET_REPLACE_EXECUTE']:
             raise Exception("Invalid ActionMode parameter")
 
         if 'StackName' not in decoded_parameters:
             raise Exception('Your UserParameters JSON must include the StackName')
 
         if 'ChangeSetName' not in decoded_parameters and decoded_parameters['ActionMode'] \
-                in ['CHANGE_SET_REPLACE', 'CHANGE_SET_EXECUTE']:
+                in ['CHANGE_SET_REPLACE', 'CHANGE_SET_EXECUTE', 'CHANGE_SET_REPLACE_EXECUTE']:
             raise Exception('Your UserParameters JSON must include the ChangeSetName')
 
         if 'TemplatePath' not in decoded_parameters and decoded_parameters['ActionMode'] \
-                in ['CREATE_UPDATE', 'REPLACE_ON_FAILURE', 'CHANGE_SET_REPLACE']:
+                in ['CREATE_UPDATE', 'REPLACE_ON_FAILURE', 'CHANGE_SET_REPLACE', 'CHANGE_SET_REPLACE_EXECUTE']:
             raise Exception('Your UserParameters JSON must include the TemplatePath')
 
         self.ActionMode = decoded_parameters['ActionMode']
@@ -113,6 +117,34 @@ class PipelineStackConfig:
                                        'UsePreviousValue': True})
         self.Parameters = parameters
 
+    def to_dict(self):
+        """Returns config as dict which can be passed to from_dict
+
+        :return: dict
+        """
+        return {
+            'Parameters': self.Parameters,
+            'Tags': self.Tags,
+            'StackPolicy': self.StackPolicy,
+            'Capabilities': self.Capabilities,
+            'Update': self.Update
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Recreates config saved by to_dict
+
+        :param data: dict returned by to_dict
+        :return: PipelineStackConfig
+        """
+        config = cls.__new__(cls)
+        config.Parameters = data['Parameters']
+        config.Tags = data['Tags']
+        config.StackPolicy = data['StackPolicy']
+        config.Capabilities = data['Capabilities']
+        config.Update = data['Update']
+        return config
+
 
 class PipelineArtifact:
     def __init__(self, artifact, region):
@@ -131,8 +163,26 @@ class PipelineArtifact:
             self.location['s3Location']['objectKey']
         )
 
+    def cache_key(self, file_name):
+        """Returns key of the file in artifact_file_cache
+
+        Artifact object key is unique per pipeline execution, revision is set only for source artifacts.
+
+        :param file_name: file name in artifact
+        :return: tuple
+        """
+        return (self.location['s3Location']['bucketName'], self.location['s3Location']['objectKey'],
+                self.revision, file_name)
+
+    def get_cached_file(self, key):
+        data = artifact_file_cache.get(self.cache_key(key))
+        if data is not None:
+            self.files[key] = data
+        return data
+
     def add_file(self, key, data):
         self.files[key] = file_to_dict(key, data)
+        artifact_file_cache.put(self.cache_key(key), self.files[key])
         return self.files[key]
 
 
@@ -225,15 +275,36 @@ def save_output_artifact(s3, artifact_data, filename, file_data):
         s3.upload_file(tmp_file.name, bucket, key, ExtraArgs={'ServerSideEncryption': 'aws:kms'})
 
 
+def record_job_result(job, result):
+    """Records result reported to CodePipeline, the handler reads it with pop_job_result
+
+    :param job: job ID
+    :param result: job result - success, failure or continuation
+    :return: job result
+    """
+    reported_job_results[job] = result
+    return result
+
+
+def pop_job_result(job):
+    """Returns result reported to CodePipeline for the job
+
+    :param job: job ID
+    :return: job result or None if no result was reported
+    """
+    return reported_job_results.pop(job, None)
+
+
 def put_job_failure(job, message):
     """Notify CodePipeline of a failed job
 
     :param job: job ID
     :param message: A message to be logged relating to the job status
+    :return: job result
     """
-    logger.debug('Putting job failure')
-    logger.debug(message)
+    add_log_fields(job_result='failure', job_message=message)
     code_pipeline.put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
+    return record_job_result(job, 'failure')
 
 
 def put_job_success(job, message):
@@ -241,14 +312,14 @@ def put_job_success(job, message):
 
     :param job: job ID
     :param message: A message to be logged relating to the job status
-
+    :return: job result
     """
-    logger.debug('Putting job success')
-    logger.debug(message)
+    add_log_fields(job_result='success', job_message=message)
     code_pipeline.put_job_success_result(jobId=job)
+    return record_job_result(job, 'success')
 
 
-def continue_job_later(job, message):
+def continue_job_later(job, message, state=None):
     """Notify CodePipeline of a continuing job
 
     This will cause CodePipeline to invoke the function again with the
@@ -256,12 +327,31 @@ def continue_job_later(job, message):
 
     :param job: job ID
     :param message: A message to be logged relating to the job status
+    :param state: optional dict stored in the continuation token and passed to the next invocation
+    :return: job result
     """
-    continuation_token = json.dumps({'previous_job_id': job})
+    token = dict(state) if state is not None else {}
+    token['previous_job_id'] = job
+    token['origin_job_id'] = log_context['origin_job_id'] or job
+    continuation_token = json.dumps(token)
 
-    logger.debug('Putting job continuation')
-    logger.debug(message)
+    add_log_fields(job_result='continuation', job_message=message)
     code_pipeline.put_job_success_result(jobId=job, continuationToken=continuation_token)
+    return record_job_result(job, 'continuation')
+
+
+def get_continuation_state(job_data):
+    """Returns state stored in the continuation token by continue_job_later
+
+    :param job_data: dict with job details
+    :return: dict with state, empty if there is no continuation token
+    """
+    if 'continuationToken' not in job_data:
+        return {}
+    try:
+        return json.loads(job_data['continuationToken'])
+    except ValueError:
+        return {}
 
 
 def get_file_from_artifact(s3, artifact_data: PipelineArtifact, file_name):
@@ -275,6 +365,10 @@ def get_file_from_artifact(s3, artifact_data: PipelineArtifact, file_name):
     if not artifact_data:
         raise ValueError('failed to get file {} from artifact: Artifact not found'.format(file_name))
 
+    cached = artifact_data.get_cached_file(file_name)
+    if cached is not None:
+        return cached
+
     bucket = artifact_data.location['s3Location']['bucketName']
     key = artifact_data.location['s3Location']['objectKey']
     try:
@@ -0,0 +1,174 @@
+import datetime
+import json
+import os
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+RETENTION_PREFIX = '_retention/'
+MANIFEST_VERSION = 1
+MANIFEST_WRITE_ATTEMPTS = 3
+DELETE_BATCH_SIZE = 1000
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_RETAINED_TEMPLATES = 3
+
+
+def manifest_key(stack):
+    """Returns key of the stack retention manifest
+
+    :param stack: stack name
+    :return: key in templates bucket
+    """
+    return "{}{}.json".format(RETENTION_PREFIX, stack)
+
+
+def load_manifest(client, bucket, key):
+    """Loads retention manifest from templates bucket
+
+    Manifest keeps the newest template keys uploaded for a stack.
+
+    :param client: s3 client
+    :param bucket: templates bucket name
+    :param key: manifest key
+    :return: tuple manifest dict, manifest ETag or None if manifest doesn't exist
+    """
+    try:
+        response = client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return {'version': MANIFEST_VERSION, 'keys': []}, None
+        raise e
+    return json.loads(response['Body'].read()), response['ETag']
+
+
+def save_manifest(client, bucket, key, manifest, etag):
+    """Saves retention manifest only if it wasn't modified since it was loaded
+
+    :param client: s3 client
+    :param bucket: templates bucket name
+    :param key: manifest key
+    :param manifest: manifest dict
+    :param etag: ETag returned by load_manifest
+    :return: True if saved, False if manifest was modified by another job
+    """
+    kwargs = {'IfMatch': etag} if etag is not None else {'IfNoneMatch': '*'}
+    try:
+        client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest, separators=(',', ':')), **kwargs)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['PreconditionFailed', 'ConditionalRequestConflict']:
+            return False
+        raise e
+
+
+def update_manifest(stack, update):
+    """Applies update function to the stack retention manifest, retrying on concurrent modifications
+
+    Retention is bookkeeping only, S3 and botocore errors are logged and never fail the job.
+
+    :param stack: stack name
+    :param update: function modifying manifest dict in place
+    """
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    key = manifest_key(stack)
+    try:
+        for _ in range(MANIFEST_WRITE_ATTEMPTS):
+            manifest, etag = load_manifest(client, bucket, key)
+            update(manifest)
+            if save_manifest(client, bucket, key, manifest, etag):
+                return
+        logger.warning('Retention manifest %s not updated, too many concurrent modifications', key)
+    except (BotoCoreError, ClientError) as e:
+        logger.warning('Failed to update retention manifest %s: %s', key, e)
+
+
+def record_template_reference(stack, key):
+    """Marks template key as referenced by the stack
+
+    :param stack: stack name
+    :param key: template key in templates bucket
+    """
+    retained = int(os.environ.get('TEMPLATE_RETENTION_KEYS', DEFAULT_RETAINED_TEMPLATES))
+
+    def update(manifest):
+        manifest['keys'] = ([key] + [k for k in manifest['keys'] if k != key])[:retained]
+
+    update_manifest(stack, update)
+
+
+def remove_stack_references(stack):
+    """Removes template references of deleted stack
+
+    The empty manifest is kept so garbage collection can tell it from a missing manifest.
+
+    :param stack: stack name
+    """
+    update_manifest(stack, lambda manifest: manifest.update(keys=[]))
+
+
+def load_referenced_keys(client, bucket):
+    """Loads template keys referenced by all stack manifests
+
+    :param client: s3 client
+    :param bucket: templates bucket name
+    :return: tuple set of referenced keys, number of manifests
+    """
+    referenced, manifests = set(), 0
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=RETENTION_PREFIX):
+        for obj in page.get('Contents', []):
+            manifest, _ = load_manifest(client, bucket, obj['Key'])
+            referenced.update(manifest['keys'])
+            manifests += 1
+    return referenced, manifests
+
+
+def delete_objects(client, bucket, keys):
+    """Deletes objects using batched DeleteObjects calls
+
+    :param client: s3 client
+    :param bucket: bucket name
+    :param keys: list of keys to delete
+    :return: number of deleted objects
+    """
+    deleted = 0
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        response = client.delete_objects(Bucket=bucket,
+                                         Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True})
+        for error in response.get('Errors', []):
+            logger.warning('Failed to delete %s: %s', error['Key'], error['Message'])
+        deleted += len(batch) - len(response.get('Errors', []))
+    return deleted
+
+
+def collect_garbage(max_age_days=None):
+    """Deletes templates bucket objects not referenced by retention manifests and older than max age
+
+    Refuses to run when there are no manifests in a non-empty bucket, all templates would be deleted otherwise.
+
+    :param max_age_days: minimal age of deleted objects, TEMPLATE_RETENTION_DAYS env variable is used by default
+    :return: number of deleted objects
+    """
+    if max_age_days is None:
+        max_age_days = int(os.environ.get('TEMPLATE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    client = boto3.client('s3')
+    bucket = os.environ.get('PIPELINE_TEMPLATES_BUCKET')
+    referenced, manifests = load_referenced_keys(client, bucket)
+    if manifests == 0 and client.list_objects_v2(Bucket=bucket, MaxKeys=1).get('KeyCount', 0) > 0:
+        raise Exception('Retention manifests not found in {}, refusing to delete objects'.format(bucket))
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max_age_days)
+
+    expired, deleted = 0, 0
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+        keys = [obj['Key'] for obj in page.get('Contents', [])
+                if obj['Key'] not in referenced and not obj['Key'].startswith(RETENTION_PREFIX)
+                and obj['LastModified'] < cutoff]
+        expired += len(keys)
+        deleted += delete_objects(client, bucket, keys)
+
+    logger.info('Deleted %s of %s expired objects from %s', deleted, expired, bucket)
+    return deleted
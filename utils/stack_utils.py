@@ -1,11 +1,18 @@
 import json
+import re
+import threading
 
 from botocore.exceptions import ClientError
 
 from utils.logging_utils import get_logger
 from utils.pipeline_utils import PipelineStackConfig
 
-logger = get_logger()
+logger = get_logger(__name__)
+CHANGE_SET_NAME_MAX_LENGTH = 128
+JOB_ID_LENGTH = 36
+JOB_ID_PATTERN = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+NO_CHANGES_REASONS = ["The submitted information didn't contain changes.",
+                      'No updates are to be performed.']
 
 
 def get_stack_output(cf, stack_name):
@@ -18,7 +25,7 @@ def get_stack_output(cf, stack_name):
     stack_details = cf.describe_stacks(StackName=stack_name)
     output_params = stack_details['Stacks'][0].get('Outputs', [])
     outputs = {}
-    logger.info(output_params)
+    logger.debug('stack outputs %s', output_params)
     for op in output_params:
         outputs[op['OutputKey']] = op['OutputValue']
     return outputs
@@ -64,7 +71,7 @@ def create_stack(cf, stack, template_url, config: PipelineStackConfig, role_arn=
     :param config: Obj with tags, parameters and stack policy
     :param role_arn: role to be assumed by cfn
     """
-    logger.debug("create_stack " + template_url)
+    logger.debug("create_stack %s", template_url)
 
     kwargs = {}
     if config.StackPolicy is not None:
@@ -126,6 +133,22 @@ def get_stack_status(cf, stack):
     return stack_description['Stacks'][0]['StackStatus']
 
 
+def get_stack_status_if_exists(cf, stack):
+    """Get the status of a CloudFormation stack which may not exist
+
+    :param cf: cfn client
+    :param stack: stack name to describe
+    :return: status or None if stack doesn't exist
+    """
+    try:
+        return get_stack_status(cf, stack)
+    except ClientError as e:
+        if "does not exist" in e.response['Error']['Message']:
+            return None
+        else:
+            raise e
+
+
 def change_set_exists(cf, stack, change_set):
     """Check if a CFN change_set exists or not
 
@@ -155,7 +178,7 @@ def create_change_set(cf, cfn_stack_name, cfn_change_set_name, template_url,
     :param config: config object with parameters, tags etc
     :param role_arn: role arn to be used by cfn
     """
-    logger.debug("create_change-set, template: " + template_url)
+    logger.debug("create_change-set, template: %s", template_url)
     change_set_type = 'UPDATE' if config.Update is True else 'CREATE'
 
     kwargs = {}
@@ -205,3 +228,98 @@ def delete_change_set(cf, cfn_stack_name, cfn_change_set_name):
     :param cfn_change_set_name: change set name
     """
     cf.delete_change_set(ChangeSetName=cfn_change_set_name, StackName=cfn_stack_name)
+
+
+def change_set_name_prefix(cfn_change_set_name):
+    """Returns prefix shared by all change sets created by unique_change_set_name
+
+    :param cfn_change_set_name: change set name from user parameters
+    :return: change set name prefix
+    """
+    return cfn_change_set_name[:CHANGE_SET_NAME_MAX_LENGTH - JOB_ID_LENGTH - 1] + '-'
+
+
+def unique_change_set_name(cfn_change_set_name, job_id):
+    """Returns change set name unique for the pipeline job
+
+    :param cfn_change_set_name: change set name from user parameters
+    :param job_id: pipeline job id
+    :return: change set name
+    """
+    return change_set_name_prefix(cfn_change_set_name) + job_id
+
+
+def describe_change_set(cf, cfn_stack_name, cfn_change_set_name):
+    """Returns change set status and status reason
+
+    :param cf: cfn client
+    :param cfn_stack_name: stack name
+    :param cfn_change_set_name: change set name
+    :return: tuple status, status reason
+    """
+    details = cf.describe_change_set(ChangeSetName=cfn_change_set_name, StackName=cfn_stack_name)
+    return details['Status'], details.get('StatusReason', '')
+
+
+def change_set_has_no_changes(status, reason):
+    """Check if change set failed only because there was nothing to change
+
+    :param status: change set status
+    :param reason: change set status reason
+    :return: True or False
+    """
+    return status == 'FAILED' and any(r in reason for r in NO_CHANGES_REASONS)
+
+
+def delete_stale_change_sets(cf, cfn_stack_name, cfn_change_set_prefix, keep=None):
+    """Deletes change sets created by previous jobs
+
+    :param cf: cfn client
+    :param cfn_stack_name: stack name
+    :param cfn_change_set_prefix: prefix returned by change_set_name_prefix, only names made of the prefix
+                                  and a job id are deleted
+    :param keep: change set name which shouldn't be deleted
+    """
+    pattern = re.compile(re.escape(cfn_change_set_prefix) + JOB_ID_PATTERN + '$')
+    kwargs = {}
+    while True:
+        try:
+            response = cf.list_change_sets(StackName=cfn_stack_name, **kwargs)
+        except ClientError as e:
+            if "does not exist" in e.response['Error']['Message']:
+                return
+            raise e
+        for summary in response.get('Summaries', []):
+            name = summary['ChangeSetName']
+            if name == keep or not pattern.match(name):
+                continue
+            if summary['Status'] in ['CREATE_PENDING', 'CREATE_IN_PROGRESS'] or \
+                    summary.get('ExecutionStatus') == 'EXECUTE_IN_PROGRESS':
+                continue
+            logger.debug("deleting stale change set %s", name)
+            delete_change_set(cf, cfn_stack_name, name)
+        if 'NextToken' not in response:
+            return
+        kwargs['NextToken'] = response['NextToken']
+
+
+def start_change_set_cleanup(cf, cfn_stack_name, cfn_change_set_prefix, keep=None):
+    """Deletes stale change sets in a background thread
+
+    Errors are only logged, cleanup is best effort and shouldn't fail the job.
+
+    :param cf: cfn client
+    :param cfn_stack_name: stack name
+    :param cfn_change_set_prefix: prefix of change set names to delete
+    :param keep: change set name which shouldn't be deleted
+    :return: started thread
+    """
+    def cleanup():
+        try:
+            delete_stale_change_sets(cf, cfn_stack_name, cfn_change_set_prefix, keep)
+        except Exception as e:
+            logger.warning('Failed to delete stale change sets of %s: %s', cfn_stack_name, e)
+
+    thread = threading.Thread(target=cleanup, daemon=True)
+    thread.start()
+    return thread